@@ -101,7 +101,12 @@ import re
 import sys
 import os
 import argparse
+import shlex
+import json
+import locale
+import mmap
 from io import StringIO
+from functools import lru_cache, partial
 
 today = dt.date.today
 
@@ -217,6 +222,37 @@ def ordinal(value):
 
     return ordval
 
+def anniversary(desc, yyyy):
+    """Replace "{YYYY}" with the ordinal of years passed since YYYY"""
+    if "{" in desc and "}" in desc:
+        try:
+            oc = int((" %s " % desc).split(" {")[1].split("} ")[0])
+            desc = desc.replace("{%s}" % oc, ordinal(yyyy - oc))
+        except:
+            pass
+    return desc.replace("\{", "{").replace("\}", "}")
+
+class Month(object):
+    """Calendar facts about a month
+
+    wd is the weekday of the first day (0 is Monday, like monthrange), dy
+    the number of days and weekdays maps isoweekdays to the days of the
+    month falling on them, so weekdays[7][-1] is the last Sunday. Months
+    are shared through month(), so don't modify them.
+    """
+    def __init__(self, yyyy, mm):
+        self.fw = dt.date(yyyy, mm, 1)
+        self.wd, self.dy = cal.monthrange(yyyy, mm)
+        self.weekdays = {}
+        for d in range(1, 8):
+            self.weekdays[d] = tuple(range((d-self.wd-1) % 7 + 1,
+                                           self.dy+1, 7))
+
+@lru_cache(maxsize=256)
+def month(yyyy, mm):
+    """Shared Month instance, most lines target the same few months"""
+    return Month(yyyy, mm)
+
 class Entry(object):
     """Calender Entry
 
@@ -238,46 +274,27 @@ class Entry(object):
     def __new__(cls, line='', bdt=today(), edt=None, exp=True):
         self = super(Entry, cls).__new__(cls)
         self.comm = ''
-        line = line.strip()
         if edt:
             self.dt = edt
-            self.desc = line
+            self.desc = line.strip()
             return self
-        if len(line) < 14 or line.count(' ') < 4:
-            return line
-        yyyy, mm, dd, wd = line.split(' ')[:4]
-        self.desc = line[14:]
-        try:
-            yyyy = int(yyyy)
-            mm = int(mm)
-            dd = int(dd)
-            # week/day
-            if dd < 1:
-                w = int(wd[0])
-                d = int(wd[1])
-            # periodic
-            else:
-                w = -1
-                d = int(wd)
+        f = line.fields if isinstance(line, Line) else fields(line)
+        line = line.strip()
         # Must be a comment then
-        except:
+        if f is None:
             return line
-        if not exp and not wd.startswith("00"):
+        yyyy, mm, dd, w, d, self.desc = f
+        if not exp and not line.split(' ')[3].startswith("00"):
             return None
         if yyyy < 1970: yyyy = bdt.year
         if mm < 1: mm = bdt.month
-        if "{" in self.desc and "}" in self.desc:
-            try:
-                oc = int((" %s " % self.desc).split(" {")[1].split("} ")[0])
-                self.desc = self.desc.replace("{%s}" % oc, ordinal(yyyy - oc))
-            except:
-                pass
-        self.desc = self.desc.replace("\{", "{").replace("\}", "}")
+        self.desc = anniversary(self.desc, yyyy)
         # week/day
         try:
-            fw = dt.date(yyyy, mm, 1)
+            mo = month(yyyy, mm)
         except:
             return line
+        fw = mo.fw
         # every week
         if exp and w == 0 and d != 0:
             entries = []
@@ -289,13 +306,13 @@ class Entry(object):
             return entries
         # last week of the month
         if exp and w == 9 and d != 0:
-            fw = dt.datetime(yyyy, mm, cal.monthrange(yyyy, mm)[1])
+            fw = fw.replace(day=mo.dy)
             n = dt.timedelta(days=d-fw.isoweekday())
             dd = (fw + n).day
         # If this date doesn't exist within this month then there is probably
         # no week starting with that day
         if exp and dd < 1 and w != 0 and \
-             (w*7)-6 > cal.monthrange(yyyy, mm)[1]:
+             (w*7)-6 > mo.dy:
             return
         # every day, but show only once
         if exp and w == 0 and d == 0:
@@ -347,20 +364,33 @@ class Entry(object):
 
 class Entries(list):
     def __init__(self, fp=os.path.expanduser('~/.cal.dat'), bdt=(today(),),
-                 exp=True, comm=False, every=False):
+                 exp=True, comm=False, every=False, argv=None):
         list.__init__(self)
-        self.caldat = open(fp) if isinstance(fp, str) else fp
+        argv = sys.argv if argv is None else argv
         self.bdt = bdt
         self.years = [d.year for d in bdt[0 if hasattr(bdt[0],
                                                        'year') else 1:]]
         self.months = [d.month for d in bdt[0 if hasattr(bdt[0],
                                                          'month') else 1:]]
+        # Only read the months we're after if the data file is indexed
+        if isinstance(fp, str) and not every and os.path.exists(fp + '.idx'):
+            try:
+                fp = Index(fp)
+            except (IOError, UnicodeError):
+                pass # Stale index that can't be rewritten, read all of it
+        if isinstance(fp, Index) and not every:
+            self.caldat = fp.lines([(y, m) for y in self.years
+                                           for m in self.months])
+        elif isinstance(fp, Index):
+            self.caldat = open(fp.fp)
+        else:
+            self.caldat = open(fp) if isinstance(fp, str) else fp
         self.days = []
         # If our first date is None, skip highlighting
         if bdt[0] == None:
             pass
         elif (bdt[0] and hasattr(bdt[0], 'day') and bdt[0].day != 1) or \
-           (today().day == 1 or '1' in sys.argv or '01' in sys.argv):
+           (today().day == 1 or '1' in argv or '01' in argv):
             for d in bdt:
                 if hasattr(d, 'day'):
                     self.days.append(d.day)
@@ -370,17 +400,21 @@ class Entries(list):
         # It's necessary to first create a whole list of entries because
         # otherwise comments would end up on wrong entries ...
         entries = []
+        last = None # Entry of the line comments belong to, if any
         for line in self.caldat:
             entry = Entry(line, bdt[0 if hasattr(bdt[0], 'day') else 1],
                           exp=exp)
             if isinstance(entry, Entry):
                 entries.append(entry) # self.append sorts, quicker that way
+                last = entry
             elif isinstance(entry, list):
                 entries.extend(entry)
-                continue
-            elif self.comm and isinstance(entry, str) and len(entries) > 0:
-                entries[-1].comm += ('\n' + entry)
-                continue
+                last = entry[-1] if entry else None
+            elif isinstance(entry, str):
+                if self.comm and last:
+                    last.comm += ('\n' + entry)
+            else:
+                last = None
 
         # ... hence we filter out entries later
         for entry in entries:
@@ -399,7 +433,6 @@ class Entries(list):
             limit = int(limit[:-1])
         except:
             limit = int(limit)
-        entries = Entries()
         for i in range(len(self)):
             if self[0].dt < today():
                  del self[0]
@@ -448,9 +481,373 @@ class Entries(list):
         list.append(self, obj)
         self.sort()
 
+DATE, WEEKLY, NTH, LAST, PERIODIC = range(5)
+
+def fields(line):
+    """Split a line into yyyy, mm, dd, w, d and desc, None for comments"""
+    line = line.strip()
+    if len(line) < 14 or line.count(' ') < 4:
+        return
+    yyyy, mm, dd, wd = line.split(' ')[:4]
+    try:
+        yyyy = int(yyyy)
+        mm = int(mm)
+        dd = int(dd)
+        if dd < 1:
+            w = int(wd[0])
+            d = int(wd[1])
+        else:
+            w = -1
+            d = int(wd)
+    except:
+        return
+    return yyyy, mm, dd, w, d, line[14:]
+
+class Line(str):
+    """Line of a data file along with its fields(), see batch"""
+    def __new__(cls, line):
+        self = str.__new__(cls, line)
+        self.fields = fields(line)
+        return self
+
+def rule(line):
+    """Parse a line into a (kind, yyyy, mm, dd, w, d, desc) rule
+
+    Wildcard years and months are -1. Comments, as well as daily entries
+    which are only ever shown once, return None.
+
+    >>> rule("-999 -9 -9 15 First Friday")
+    (2, -1, -1, -9, 1, 5, 'First Friday')
+    """
+    try:
+        yyyy, mm, dd, w, d, desc = fields(line)
+    except TypeError:
+        return
+    if yyyy < 1970: yyyy = -1
+    if mm < 1: mm = -1
+    if dd < 1 and not 0 < d < 8:
+        return
+    elif dd < 1:
+        kind = WEEKLY if w == 0 else LAST if w == 9 else NTH
+    elif d == 0:
+        kind = DATE
+    elif d > 1:
+        kind = PERIODIC
+    else:
+        return
+    return (kind, yyyy, mm, dd, w, d, desc)
+
+def months(sdt, edt):
+    """Year and month tuples from sdt to edt"""
+    for i in range(sdt.year*12 + sdt.month-1, edt.year*12 + edt.month):
+        yield divmod(i, 12)[0], i % 12 + 1
+
+def getnp():
+    """NumPy if it's installed, None otherwise
+
+    Only imported when rules are expanded, it's slow to import and ls
+    doesn't need it.
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+class Occurrences(object):
+    """Columnar result of Rules.expand
+
+    dates holds one date per occurrence (a datetime64[D] array when
+    expanded with NumPy), index the position of the rule it came from.
+    Descriptions are only rendered when iterating.
+    """
+    def __init__(self, rules, dates, index):
+        self.rules = rules
+        self.dates = dates
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        dates = self.dates
+        if hasattr(dates, 'tolist'): dates = dates.tolist()
+        for date, i in zip(dates, list(self.index)):
+            yyyy, desc = self.rules[i][1], self.rules[i][6]
+            yield date, anniversary(desc, yyyy if yyyy > 0 else date.year)
+
+class Rules(list):
+    """Recurring and fixed date rules of a cal.dat file
+
+    Unlike Entries, which expands everything for the months asked for one
+    Entry at a time, rules are parsed once and can be expanded for a whole
+    range of dates in bulk, with NumPy if it's installed:
+
+    >>> rules = Rules(["2022 03 14 00 Birthday",
+    ...                "-999 12 24 00 Xmas {1990}",
+    ...                "-999 -9 -9 03 Every Wednesday",
+    ...                "2023 -9 -9 01 Every Monday in 2023",
+    ...                "-999 -9 -9 25 Second Friday",
+    ...                "-999 -9 -9 97 Last Sunday",
+    ...                "-999 -9 01 05 Every 5 days",
+    ...                "2022 -9 02 04 Every 4 days in 2022",
+    ...                "-999 01 18 03 Water plants",
+    ...                "2021 11 30 10 Every 10 days"])
+    >>> sdt, edt = dt.date(2020, 12, 15), dt.date(2024, 2, 10)
+    >>> py = list(rules.expand(sdt, edt, 'python'))
+    >>> getnp() is None or list(rules.expand(sdt, edt, 'numpy')) == py
+    True
+    >>> march = rules.expand(dt.date(2022, 3, 1), dt.date(2022, 3, 7))
+    >>> [date.day for date, desc in march if desc == 'Water plants']
+    [1, 4, 7]
+
+    Periodic entries skip their first day and restart every month, or
+    every year if their month is given, just like Entry does. Rules
+    deliberately differ from Entry where it goes astray:
+
+    - periodic entries with a fixed start carry on for good, Entry only
+      finds them in their first year (and in Decembers after that)
+    - a fifth or last weekday that would fall into the next month yields
+      nothing, Entry shows a day early in the month instead
+    - weekly entries always include a fifth weekday, Entry misses it in
+      some months
+    - daily entries ("01", "00" weekday) aren't expanded, Entry shows
+      them only once on the day asked for
+    """
+    def __init__(self, fp=os.path.expanduser('~/.cal.dat')):
+        list.__init__(self)
+        caldat = open(fp) if isinstance(fp, str) else fp
+        for line in caldat:
+            r = rule(line)
+            if r:
+                list.append(self, r)
+
+    def expand(self, sdt, edt, engine=None):
+        """All occurrences from sdt to edt (inclusive) as Occurrences"""
+        np = getnp() if engine in (None, 'numpy') else None
+        if engine is None:
+            engine = 'python' if np is None else 'numpy'
+        if engine == 'numpy' and np is None:
+            raise ImportError("NumPy is required for the numpy engine")
+        elif engine not in ('numpy', 'python'):
+            raise ValueError("Unknown engine '%s'" % engine)
+        if sdt > edt:
+            return Occurrences(self, [], [])
+        if engine == 'numpy':
+            return self._expand_np(sdt, edt)
+        return self._expand_py(sdt, edt)
+
+    def _expand_py(self, sdt, edt):
+        hits = []
+        for yyyy, mm in months(sdt, edt):
+            mo = month(yyyy, mm)
+            for i, (kind, y, m, dd, w, d, desc) in enumerate(self):
+                if y not in (-1, yyyy) or m not in (-1, mm):
+                    continue
+                if kind == DATE:
+                    days = [dd] if dd <= mo.dy else []
+                elif kind == WEEKLY:
+                    days = mo.weekdays[d]
+                elif kind == NTH:
+                    days = mo.weekdays[d][w-1:w]
+                elif kind == LAST:
+                    days = mo.weekdays[d][-1:]
+                elif m > 0:
+                    continue
+                else:
+                    days = range(dd+d, mo.dy+1, d)
+                for day in days:
+                    date = mo.fw.replace(day=day)
+                    if sdt <= date <= edt:
+                        hits.append((date, i))
+        # Periodic entries starting in a given month carry on past it, up
+        # to the end of the year if that's a wildcard
+        for i, (kind, y, m, dd, w, d, desc) in enumerate(self):
+            if kind != PERIODIC or m < 0:
+                continue
+            for yyyy in [y] if y > 0 else range(sdt.year, edt.year+1):
+                try:
+                    date = dt.date(yyyy, m, dd)
+                except ValueError:
+                    continue
+                end = edt if y > 0 else min(edt, dt.date(yyyy, 12, 31))
+                k = max(1, -((date - sdt).days // d))
+                date += dt.timedelta(days=d*k)
+                while date <= end:
+                    hits.append((date, i))
+                    date += dt.timedelta(days=d)
+        hits.sort()
+        return Occurrences(self, [h[0] for h in hits], [h[1] for h in hits])
+
+    def _expand_np(self, sdt, edt):
+        np = getnp()
+        mo = np.arange(np.datetime64(sdt, 'M'), np.datetime64(edt, 'M') + 1)
+        fw = mo.astype('datetime64[D]')
+        ln = ((mo + 1).astype('datetime64[D]') - fw).astype(int)
+        fi = (fw.astype(int) + 3) % 7 + 1
+        li = (fi + ln - 2) % 7 + 1
+        years = mo.astype(int) // 12 + 1970
+        mons = mo.astype(int) % 12 + 1
+        kind, y, m, dd, w, d = np.array([r[:6] for r in self],
+                                        dtype=int).reshape(-1, 6).T
+        carry = (kind == PERIODIC) & (m > 0)
+        match = ((y[:, None] < 0) | (y[:, None] == years)) & \
+                ((m[:, None] < 0) | (m[:, None] == mons)) & ~carry[:, None]
+        # Broadcast per month values against (rule, month, occurrence)
+        fi, ln, li = fi[:, None], ln[:, None], li[:, None]
+        dates, index = [], []
+        for k, n in ((DATE, 1), (WEEKLY, 5), (NTH, 1), (LAST, 1),
+                     (PERIODIC, 15)):
+            g = np.flatnonzero((kind == k) & ~carry)
+            if not len(g):
+                continue
+            gdd, gw, gd = dd[g, None, None], w[g, None, None], d[g, None, None]
+            if k == DATE:
+                offs = gdd - 1 + 0*fi
+            elif k == WEEKLY:
+                offs = (gd-fi) % 7 + 7*np.arange(n)
+            elif k == NTH:
+                offs = (gd-fi) % 7 + 7*(gw-1)
+            elif k == LAST:
+                offs = ln-1 - (li-gd) % 7
+            else:
+                offs = gdd-1 + gd*np.arange(1, n+1) + 0*fi
+            ok = match[g, :, None] & (offs < ln)
+            r, c, _ = np.nonzero(ok)
+            dates.append(fw[c] + offs[ok])
+            index.append(g[r])
+        # Periodic entries starting in a given month carry on past it, up
+        # to the end of the year if that's a wildcard
+        g = np.flatnonzero(carry)
+        if len(g):
+            n = np.where(y[g] < 0, edt.year - sdt.year + 1, 1)
+            g = np.repeat(g, n)
+            yy = np.where(y[g] < 0, sdt.year + np.arange(n.sum()) -
+                          np.repeat(np.cumsum(n) - n, n), y[g])
+            end = np.array(yy - 1969, dtype='datetime64[Y]') \
+                  .astype('datetime64[D]') - 1
+            end = np.where(y[g] < 0, np.minimum(end, np.datetime64(edt)),
+                           np.datetime64(edt))
+            start = np.array((yy-1970)*12 + m[g]-1, dtype='datetime64[M]')
+            first = start.astype('datetime64[D]')
+            valid = dd[g] <= ((start+1).astype('datetime64[D]') - first
+                              ).astype(int)
+            first = first[valid] + dd[g][valid]-1
+            g, step, end = g[valid], d[g][valid], end[valid]
+            k0 = np.maximum(1, -((first - np.datetime64(sdt)).astype(int)
+                                 // step))
+            k1 = (end - first).astype(int) // step
+            n = np.maximum(0, k1 - k0 + 1)
+            k = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n) + \
+                np.repeat(k0, n)
+            dates.append(np.repeat(first, n) + k*np.repeat(step, n))
+            index.append(np.repeat(g, n))
+        dates = np.concatenate(dates) if dates else fw[:0]
+        index = np.concatenate(index) if index else np.array([], dtype=int)
+        keep = (dates >= np.datetime64(sdt)) & (dates <= np.datetime64(edt))
+        dates, index = dates[keep], index[keep]
+        order = np.lexsort((index, dates))
+        return Occurrences(self, dates[order], index[order])
+
+class Index(dict):
+    """Byte offsets of the lines of a cal.dat file by year and month
+
+    Entries dated within a specific month are kept under "YYYY MM" along
+    with their comments, everything else (recurring rules) under "*". Both
+    are spans of [start, end] byte offsets, so a query for a month only
+    has to read those slices of the file instead of walking all of it.
+
+    The index lives next to the data file as FILE.idx and is rebuilt
+    whenever the data file has changed since. Entries read through it are
+    the same as without it, comments included:
+
+    >>> import tempfile
+    >>> fp = os.path.join(tempfile.mkdtemp(), 'cal.dat')
+    >>> with open(fp, 'w') as f:
+    ...     n = f.write("-999 -9 01 00 Rent\\n2020 01 10 00 Dentist\\n"
+    ...                 "-999 -9 31 00 Payday\\n"
+    ...                 "payday is late in short months\\n")
+    >>> bdt = (dt.date(2020, 2, 1),)
+    >>> before = repr(Entries(fp, bdt, comm=True))
+    >>> index = Index(fp)
+    >>> repr(Entries(fp, bdt, comm=True)) == before
+    True
+    """
+    def __init__(self, fp):
+        dict.__init__(self)
+        self.fp = fp
+        self.path = fp + '.idx'
+        # Same as open() uses when reading without the index
+        self.encoding = locale.getpreferredencoding(False)
+        st = os.stat(fp)
+        # The first item is bumped whenever lines are keyed differently
+        self.stamp = [3, st.st_size, st.st_mtime_ns]
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data['stamp'] == self.stamp:
+                self.update(data['spans'])
+                return
+        except (IOError, ValueError, KeyError, TypeError):
+            pass
+        self.build()
+
+    @staticmethod
+    def key(line):
+        """Index key of a line, None for comments"""
+        f = fields(line)
+        if f is None or f[1] > 12 or f[0] > dt.MAXYEAR:
+            return
+        yyyy, mm, dd, w, d, desc = f
+        # Periodic entries carry on past the month they start in and weekly
+        # ones can spill into the month before
+        if yyyy < 1970 or mm < 1 or (dd > 0 and d > 1) or \
+           (dd < 1 and w == 0):
+            return '*'
+        return '%d %02d' % (yyyy, mm)
+
+    def add(self, key, start, end):
+        if start == end:
+            return
+        spans = self.setdefault(key, [])
+        if spans and spans[-1][1] == start:
+            spans[-1][1] = end
+        else:
+            spans.append([start, end])
+
+    def build(self):
+        """Scan the data file and write FILE.idx"""
+        self.clear()
+        key, start = '*', 0
+        with open(self.fp, 'rb') as f:
+            data = f.read()
+        # Split lines like open() does, at \n, \r\n or a lone \r
+        for line in re.finditer(rb'[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+', data):
+            k = self.key(line.group().decode(self.encoding))
+            if k:
+                self.add(key, start, line.start())
+                key, start = k, line.start()
+        self.add(key, start, len(data))
+        with open(self.path, 'w') as f:
+            json.dump({'stamp': self.stamp, 'spans': self}, f)
+
+    def lines(self, keys):
+        """Lines of recurring rules and entries of (year, month) keys"""
+        keys = set(['*'] + ['%d %02d' % key for key in keys])
+        spans = sorted(span for key in keys for span in self.get(key, []))
+        if not spans:
+            return []
+        with open(self.fp, 'rb') as f, \
+             mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            text = b''.join(data[s:e] for s, e in spans) \
+                   .decode(self.encoding)
+        # Universal newlines, just like reading with open()
+        return list(StringIO(text, newline=None))
+
 class Calendar(dict):
-    def __init__(self, bdt=today(), hl=(today(),), entries=[]):
+    def __init__(self, bdt=today(), hl=(today(),), entries=[], argv=None):
         dict.__init__(self)
+        argv = sys.argv if argv is None else argv
         self.appointments = []
         for entry in entries:
             self.appointments.append(entry.dt.day)
@@ -458,16 +855,16 @@ class Calendar(dict):
         self.bdt = bdt
         self.hl = ()
         self.bd = [str(entry.dt.day) for entry in entries]
-        if hl[0].day != 1 or (today().day == 1 or '1' in sys.argv or '01' in \
-           sys.argv):
+        if hl[0].day != 1 or (today().day == 1 or '1' in argv or '01' in \
+           argv):
             self.hl = hl
-        wd, dy = cal.monthrange(self.bdt.year, self.bdt.month)
-        for day in range(1, dy+1):
+        mo = month(self.bdt.year, self.bdt.month)
+        for day in range(1, mo.dy+1):
             self[day] = []
-            if cal.weekday(self.bdt.year, self.bdt.month, day) == 6:
-                hl = dt.date(self.bdt.year, self.bdt.month, day) in self.hl
-                self.mark(day, fmt.fs('white' if hl else 'magenta', 'bright'),
-                          fmt.fs('white', 'nobright' if hl else 'normal'))
+        for day in mo.weekdays[7]:
+            hl = mo.fw.replace(day=day) in self.hl
+            self.mark(day, fmt.fs('white' if hl else 'magenta', 'bright'),
+                      fmt.fs('white', 'nobright' if hl else 'normal'))
 
     def __setitem__(self, key, item):
         dict.__setitem__(self, key, item)
@@ -499,7 +896,7 @@ class Calendar(dict):
                       ">%s" % fmt.bf('blue', 'white'))
         for day in self.appointments:
             self.mark(day, fmt.s('underline'), fmt.s('normal'))
-        wd, dy = cal.monthrange(self.bdt.year, self.bdt.month)
+        wd = month(self.bdt.year, self.bdt.month).wd
         my = self.bdt.strftime("%B %Y")
         out = " "*int((22-len(my))/2) + my
         while len(out) < 22: out += " "
@@ -592,8 +989,8 @@ def icsout(inp):
     sys.exit(0)
 
 def ls(bdt, pve=7, cmt=False, fp=os.path.expanduser('~/.cal.dat'), comm=False,
-       exp=True, eli=0, evo=False):
-    entries = Entries(bdt=bdt, fp=fp, comm=comm, exp=exp)
+       exp=True, eli=0, evo=False, argv=None):
+    entries = Entries(bdt=bdt, fp=fp, comm=comm, exp=exp, argv=argv)
     pvs = ""
     if pve > 0:
         if isinstance(fp, StringIO): fp.seek(0)
@@ -606,11 +1003,138 @@ def ls(bdt, pve=7, cmt=False, fp=os.path.expanduser('~/.cal.dat'), comm=False,
         pvs = ""
     if evo:
         return repr(entries)+pvs
-    cal = Calendar(bdt[0], bdt if len(bdt) > 1 else (bdt[0],), entries)
+    cal = Calendar(bdt[0], bdt if len(bdt) > 1 else (bdt[0],), entries,
+                   argv)
     if eli:
         entries.limit(eli)
     return nextTo(cal, repr(entries)+pvs)
 
+def lsargs(parser):
+    """Add the arguments of ls to parser"""
+    parser.add_argument("-l", "--limit", nargs="?", default="24",
+                        metavar="N",
+                        help="limit event output to N events from today " + \
+                             "or Nd days from today (default, if set: 24)")
+    parser.add_argument("-p", "--preview", type=int, nargs="?", default=7,
+                        metavar="N",
+                        help="preview next month's non-periodic entries " + \
+                              "(default, if set: 7)")
+    parser.add_argument("-C", "--comments",
+                        help='include comments in listing',
+                        action='store_true')
+    parser.add_argument("-n", "--noperiodic",
+                        help='do not expand periodic dates',
+                        action='store_false')
+    parser.add_argument("date", nargs='*')
+    return parser
+
+def lsopts(args, argv):
+    """Keyword arguments for ls from parsed ls arguments"""
+    opts = {'eli': 0, 'pve': 0, 'comm': False, 'exp': True}
+    date = args.date if 'date' in args else None
+    if not date:
+        opts['bdt'] = (today(),)
+    elif len(date) == 1:
+        opts['bdt'] = (dt.date(int(date[-1]), today().month, 1),)
+    elif len(date) == 2:
+        try:
+            opts['bdt'] = (dt.datetime.strptime("1 %s" % " ".join(date),
+                                                "%d %B %Y").date(),)
+        except:
+            opts['bdt'] = (dt.datetime.strptime("1 %s" % " ".join(date),
+                                                "%d %b %Y").date(),)
+    elif len(date) > 2:
+        month = date[-2:][0]
+        year = date[-2:][1]
+        opts['bdt'] = tuple([dt.datetime.strptime("%s %s %s" % \
+                                                  (day, month, year),
+                                                  "%d %B %Y").date() \
+                             for day in date[:-2]])
+    if '-l' in argv or '--limit' in argv:
+        opts['eli'] = args.limit or 24
+    if '-p' in argv or '--preview' in argv:
+        opts['pve'] = args.preview or 7
+    if 'comments' in args:
+        opts['comm'] = args.comments
+    if 'noperiodic' in args:
+        opts['exp'] = args.noperiodic
+    return opts
+
+class QueryParser(argparse.ArgumentParser):
+    """ArgumentParser raising ValueError instead of printing and exiting"""
+    def error(self, message):
+        raise ValueError(message)
+
+def query(line, fp, evo=False):
+    """Answer a query of ls arguments, e.g. "-l 10 4 12 December 2024"
+
+    Returns the output of ls and None, or None and the error message if
+    the query is invalid.
+    """
+    try:
+        argv = shlex.split(line)
+        parser = lsargs(QueryParser('query', add_help=False))
+        opts = lsopts(parser.parse_args(argv), argv)
+        return ls(fp=fp, evo=evo, argv=argv, **opts), None
+    except Exception as e:
+        return None, str(e)
+
+_batch = None # Data file and evo handed to pool processes by batch()
+
+def _batchinit(fp, evo):
+    global _batch
+    _batch = (fp, evo)
+
+def _batchquery(line):
+    return query(line, *_batch)
+
+def batch(queries, fp=os.path.expanduser('~/.cal.dat'), evo=False, jobs=1,
+          out=sys.stdout):
+    """Answer many ls queries against a single read of the data file
+
+    queries holds one query per line (see query), blank lines and lines
+    starting with # are skipped. The data file is read and its lines are
+    parsed once for all queries, each query still expands them for the
+    months it asks for. Of indexed files only the index is loaded once,
+    each query reads and parses the lines it needs.
+
+    Answers are written to out in order as soon as they're ready, spread
+    over a pool of processes if jobs > 1. Invalid queries are reported on
+    stderr, the number of them is returned.
+    """
+    queries = [q.strip() for q in queries]
+    queries = [q for q in queries if q and not q.startswith('#')]
+    # Indexed files only need the months asked for, read everything else
+    if isinstance(fp, str) and os.path.exists(fp + '.idx'):
+        try:
+            fp = Index(fp)
+        except (IOError, UnicodeError):
+            pass
+    if isinstance(fp, str):
+        with open(fp) as f:
+            fp = [Line(line) for line in f]
+    elif not isinstance(fp, Index):
+        fp = [Line(line) for line in fp]
+    def write(results):
+        failed = 0
+        for line, (result, error) in zip(queries, results):
+            if error:
+                failed += 1
+                sys.stderr.write("Invalid query '%s': %s\n" % (line, error))
+                continue
+            out.write("==> %s <==\n\n%s\n\n" % \
+                      (line, result if fmt.colors else fmt.c(result)))
+            out.flush()
+        return failed
+    if jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        # Workers get the data file once rather than with every chunk
+        with ProcessPoolExecutor(jobs, initializer=_batchinit,
+                                 initargs=(fp, evo)) as pool:
+            return write(pool.map(_batchquery, queries,
+                                  chunksize=max(1, len(queries)//(jobs*4))))
+    return write(map(partial(query, fp=fp, evo=evo), queries))
+
 if __name__ == '__main__':
     # If nothing is passed, assume ls --preview
     if len(sys.argv) > 1:
@@ -627,28 +1151,27 @@ if __name__ == '__main__':
                             help="Suppress calendar month view")
         parser = argparse.ArgumentParser(parents=[parser])
         sub_p = parser.add_subparsers(help='actions')
-        p_ls = sub_p.add_parser('ls', help='list calendar entries')
-        p_ls.add_argument("-l", "--limit", nargs="?", default="24",
-                          metavar="N",
-                          help="limit event output to N events from today " + \
-                               "or Nd days from today (default, if set: 24)")
-        p_ls.add_argument("-p", "--preview", type=int, nargs="?", default=7,
-                          metavar="N",
-                          help="preview next month's non-periodic entries " + \
-                                "(default, if set: 7)")
-        p_ls.add_argument("-C", "--comments",
-                          help='include comments in listing',
-                          action='store_true')
-        p_ls.add_argument("-n", "--noperiodic",
-                          help='do not expand periodic dates',
-                          action='store_false')
-        p_ls.add_argument("date", nargs='*')
+        p_ls = lsargs(sub_p.add_parser('ls', help='list calendar entries'))
         p_ics = sub_p.add_parser('ics',
                                  help="icalendar to ccal conversion tools")
         p_ics.add_argument('-i', metavar="FILE", nargs='?',
                            help="Read from stdin or file")
         p_ics.add_argument('-o', action='store_true',
                            help="Output entire file as ics to stdout")
+        p_idx = sub_p.add_parser('index',
+                                 help="index the data file by month for " + \
+                                      "faster lookups")
+        p_idx.set_defaults(index=True)
+        p_batch = sub_p.add_parser('batch',
+                                   help="answer many ls queries, one per " + \
+                                        "line, read from stdin or FILE")
+        p_batch.add_argument('file', metavar="FILE", nargs='?',
+                             help="file with queries (default: stdin)")
+        p_batch.add_argument('-j', '--jobs', type=int, default=1,
+                             metavar="N",
+                             help="answer queries using N processes " + \
+                                  "(default: 1)")
+        p_batch.set_defaults(batch=True)
         #p_add = sub_p.add_parser('add', help='add calendar entry')
         #p_add.add_argument("date")
         #p_add.add_argument("description")
@@ -663,52 +1186,26 @@ if __name__ == '__main__':
         if sys.argv[1] == 'ics' and 'o' in args and args.o:
             icsout(args.data_file)
 
-        if not 'date' in args or not args.date:
-            args.date = (today(),)
-        elif len(args.date) == 1:
-            args.date = (dt.date(int(args.date[-1]), today().month, 1),)
-        elif len(args.date) == 2:
-            try:
-                args.date = (dt.datetime.strptime("1 %s" % " ".join(args.date),
-                                                  "%d %B %Y").date(),)
-            except:
-                args.date = (dt.datetime.strptime("1 %s" % " ".join(args.date),
-                                                  "%d %b %Y").date(),)
-        elif len(args.date) > 2:
-            month = args.date[-2:][0]
-            year = args.date[-2:][1]
-            args.date = tuple([dt.datetime.strptime("%s %s %s" % \
-                                                    (day, month, year),
-                                                    "%d %B %Y").date() \
-                               for day in args.date[:-2]])
-        evo = args.entries_only
+        if 'index' in args:
+            # Builds FILE.idx unless it's up to date already
+            Index(os.path.expanduser(args.data_file))
+            sys.exit(0)
+
         if args.c:
             fmt.colors = args.c
-        dates = args.date
-        if '-l' in sys.argv or '--limit' in sys.argv:
-            eli = args.limit or 24
-        else:
-            eli = 0
-        if '-p' in sys.argv or '--preview' in sys.argv:
-            pve = args.preview or 7
-        else:
-            pve = 0
+
+        if 'batch' in args:
+            failed = batch(open(args.file) if args.file else sys.stdin,
+                           fp=os.path.expanduser(args.data_file),
+                           evo=args.entries_only, jobs=args.jobs)
+            sys.exit(1 if failed else 0)
+
+        opts = lsopts(args, sys.argv)
+        evo = args.entries_only
         data = args.data_file
-        if 'comments' in args:
-            comm = args.comments
-        else:
-            comm = False
-        if 'noperiodic' in args:
-            exp = args.noperiodic
-        else:
-            exp = True
     else:
-        dates = (today(),)
-        pve = 7
+        opts = {'bdt': (today(),), 'pve': 7}
         data = "~/.cal.dat"
-        comm = False
-        exp = True
-        eli = 0
         evo = False
     # Override file data with stuff from stdin
     if sys.stdin.isatty():
@@ -717,7 +1214,7 @@ if __name__ == '__main__':
         fp = sys.stdin
     if not sys.stdin.isatty():
         fp = StringIO(sys.stdin.read())
-    out = ls(bdt=dates, pve=pve, fp=fp, comm=comm, exp=exp, eli=eli, evo=evo)
+    out = ls(fp=fp, evo=evo, **opts)
     print('')
     if fmt.colors:
         print(out)